@@ -2,30 +2,59 @@
 Japanese Vocabulary Extractor - FastAPI Backend
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 from typing import Optional
+import asyncio
+import codecs
+import hashlib
+import orjson
 import sys
 import os
+import uuid
 
 # Add parent directory to path to import vocab_extractor
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from vocab_extractor import (
     extract_vocabulary,
+    iter_vocabulary,
+    close_http_client,
     load_known_words,
     save_known_words,
+    append_known_words,
     check_anki_connection,
     get_anki_decks,
     add_notes_to_anki
 )
 from pathlib import Path
 
+# File paths
+KNOWN_WORDS_PATH = Path(__file__).parent.parent / "known_words.txt"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Known words live in memory; disk writes are serialized by the lock
+    app.state.known_words = load_known_words(KNOWN_WORDS_PATH)
+    app.state.known_words_lock = asyncio.Lock()
+    # Bumped on every change; combined with a per-process id to form the ETag
+    app.state.known_words_version = 0
+    app.state.boot_id = uuid.uuid4().hex[:8]
+    yield
+    await close_http_client()
+
+
 app = FastAPI(
     title="JpVocab API",
     description="Japanese Vocabulary Extractor API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware for React frontend
@@ -38,8 +67,24 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
-# File paths
-KNOWN_WORDS_PATH = Path(__file__).parent.parent / "known_words.txt"
+
+class NonStreamingGZipMiddleware(GZipMiddleware):
+    """
+    GZip middleware that leaves streamed NDJSON responses uncompressed.
+    Older Starlette versions buffer gzip output until the response ends,
+    which would hold back every line of the stream.
+    """
+    streaming_paths = {"/api/extract"}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.streaming_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# Compress larger responses (vocabulary and known-words lists)
+app.add_middleware(NonStreamingGZipMiddleware, minimum_size=1024, compresslevel=5)
 
 
 # Pydantic models
@@ -57,6 +102,72 @@ class KnownWordsUpdate(BaseModel):
     words: list[str]
 
 
+# Response models (serialized straight to JSON bytes by Pydantic)
+class VocabularyItem(BaseModel):
+    word: str
+    reading: str
+    definition: str
+    pos: str
+
+
+class VocabularyResponse(BaseModel):
+    vocabulary: list[VocabularyItem]
+    count: int
+    known_words_count: int
+
+
+class KnownWordsList(BaseModel):
+    words: list[str]
+    count: int
+
+
+class DeckList(BaseModel):
+    decks: list[str]
+
+
+async def persist_known_words():
+    """Write the current known words to disk (run as a background task)"""
+    async with app.state.known_words_lock:
+        # Snapshot under the lock so the last save always has the latest words
+        snapshot = set(app.state.known_words)
+        await run_in_threadpool(save_known_words, snapshot, KNOWN_WORDS_PATH)
+
+
+async def persist_new_known_words(words: set):
+    """Append newly known words to disk (run as a background task)"""
+    async with app.state.known_words_lock:
+        # Skip words removed since they were added, e.g. by a clear
+        words = words & app.state.known_words
+        await run_in_threadpool(append_known_words, words, KNOWN_WORDS_PATH)
+
+
+def add_to_known_words(words: list, background_tasks: BackgroundTasks):
+    """Add words to the in-memory set and schedule appending the new ones to disk"""
+    new_words = set(words) - app.state.known_words
+    if new_words:
+        app.state.known_words.update(new_words)
+        app.state.known_words_version += 1
+    background_tasks.add_task(persist_new_known_words, new_words)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Check whether the client's If-None-Match header covers the given ETag"""
+    if_none_match = request.headers.get("if-none-match", "")
+    return etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+def check_etag(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """
+    Set caching headers for the given ETag.
+    Returns a 304 Not Modified response if the client already has it, else None.
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
 # Endpoints
 @app.get("/")
 async def root():
@@ -66,7 +177,7 @@ async def root():
 @app.get("/api/stats")
 async def get_stats():
     """Get dashboard statistics"""
-    known_words = load_known_words(KNOWN_WORDS_PATH)
+    known_words = app.state.known_words
     return {
         "known_words_count": len(known_words),
         "new_words_count": 0,
@@ -76,31 +187,48 @@ async def get_stats():
 
 @app.post("/api/extract")
 async def extract_vocab(input_data: TextInput):
-    """Extract vocabulary from Japanese text"""
+    """
+    Extract vocabulary from Japanese text.
+    Streams NDJSON: a first line with known_words_count, then one line
+    per word as soon as its definition is available.
+    """
     if not input_data.text.strip():
         raise HTTPException(status_code=400, detail="Text cannot be empty")
     
-    known_words = load_known_words(KNOWN_WORDS_PATH)
-    vocabulary = extract_vocabulary(input_data.text, known_words)
+    known_words = app.state.known_words
     
-    return {
-        "vocabulary": vocabulary,
-        "count": len(vocabulary),
-        "known_words_count": len(known_words)
-    }
-
-
-@app.post("/api/extract/file")
-async def extract_from_file(file: UploadFile = File(...)):
-    """Extract vocabulary from uploaded text file"""
-    if not file.filename.endswith('.txt'):
+    async def generate():
+        yield orjson.dumps({"known_words_count": len(known_words)}) + b"\n"
+        async for item in iter_vocabulary(input_data.text, known_words):
+            yield orjson.dumps(item) + b"\n"
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.post("/api/extract/file", response_model=VocabularyResponse)
+async def extract_from_file(request: Request):
+    """
+    Extract vocabulary from uploaded text file.
+    The raw file is sent as the request body, with its name in the
+    `filename` query parameter or the `X-Filename` header.
+    """
+    filename = request.query_params.get('filename') or request.headers.get('x-filename', '')
+    if not filename.endswith('.txt'):
         raise HTTPException(status_code=400, detail="Only .txt files are supported")
     
-    content = await file.read()
-    text = content.decode('utf-8')
+    # Decode the body incrementally instead of buffering the raw bytes
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    parts = []
+    try:
+        async for chunk in request.stream():
+            parts.append(decoder.decode(chunk))
+        parts.append(decoder.decode(b'', final=True))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded")
+    text = ''.join(parts)
     
-    known_words = load_known_words(KNOWN_WORDS_PATH)
-    vocabulary = extract_vocabulary(text, known_words)
+    known_words = app.state.known_words
+    vocabulary = await extract_vocabulary(text, known_words)
     
     return {
         "vocabulary": vocabulary,
@@ -109,26 +237,30 @@ async def extract_from_file(file: UploadFile = File(...)):
     }
 
 
-@app.get("/api/known-words")
-async def get_known_words():
+@app.get("/api/known-words", response_model=KnownWordsList)
+async def get_known_words(request: Request, response: Response):
     """Get all known words"""
-    known_words = load_known_words(KNOWN_WORDS_PATH)
-    return {"words": sorted(list(known_words)), "count": len(known_words)}
+    known_words = app.state.known_words
+    etag = f'W/"{app.state.boot_id}-{app.state.known_words_version}"'
+    not_modified = check_etag(request, response, etag)
+    if not_modified:
+        return not_modified
+    return {"words": sorted(known_words), "count": len(known_words)}
 
 
 @app.post("/api/known-words")
-async def add_known_words(update: KnownWordsUpdate):
+async def add_known_words(update: KnownWordsUpdate, background_tasks: BackgroundTasks):
     """Add words to known words list"""
-    known_words = load_known_words(KNOWN_WORDS_PATH)
-    known_words.update(update.words)
-    save_known_words(known_words, KNOWN_WORDS_PATH)
-    return {"message": f"Added {len(update.words)} words", "total": len(known_words)}
+    add_to_known_words(update.words, background_tasks)
+    return {"message": f"Added {len(update.words)} words", "total": len(app.state.known_words)}
 
 
 @app.delete("/api/known-words")
-async def clear_known_words():
+async def clear_known_words(background_tasks: BackgroundTasks):
     """Clear all known words"""
-    save_known_words(set(), KNOWN_WORDS_PATH)
+    app.state.known_words.clear()
+    app.state.known_words_version += 1
+    background_tasks.add_task(persist_known_words)
     return {"message": "Known words cleared"}
 
 
@@ -142,17 +274,22 @@ async def anki_status():
     }
 
 
-@app.get("/api/anki/decks")
-async def anki_decks():
+@app.get("/api/anki/decks", response_model=DeckList)
+async def anki_decks(request: Request, response: Response):
     """Get available Anki decks"""
     result = get_anki_decks()
     if result["success"]:
-        return {"decks": result["result"]}
+        decks = result["result"]
+        etag = f'W/"{hashlib.blake2b(orjson.dumps(decks), digest_size=8).hexdigest()}"'
+        not_modified = check_etag(request, response, etag)
+        if not_modified:
+            return not_modified
+        return {"decks": decks}
     raise HTTPException(status_code=503, detail=result.get("error", "Failed to get decks"))
 
 
 @app.post("/api/anki/import")
-async def anki_import(request: AnkiImportRequest):
+async def anki_import(request: AnkiImportRequest, background_tasks: BackgroundTasks):
     """Import vocabulary to Anki"""
     if not request.vocabulary:
         raise HTTPException(status_code=400, detail="No vocabulary to import")
@@ -167,9 +304,7 @@ async def anki_import(request: AnkiImportRequest):
         if result["success"]:
             # Mark imported words as known
             words_to_add = [item["word"] for item in request.vocabulary]
-            known_words = load_known_words(KNOWN_WORDS_PATH)
-            known_words.update(words_to_add)
-            save_known_words(known_words, KNOWN_WORDS_PATH)
+            add_to_known_words(words_to_add, background_tasks)
             
             return {
                 "success": True,
@@ -102,15 +102,44 @@ function App() {
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ text })
       })
-      const data = await res.json()
-      setVocabulary(data.vocabulary)
-      setSelectedWords(new Set(data.vocabulary.map((_, i) => i)))
-      setStats(prev => ({
-        ...prev,
-        new_words_count: data.count,
-        known_words_count: data.known_words_count
-      }))
-      showToast(`Found ${data.count} new words!`, 'success')
+      if (!res.ok) {
+        throw new Error('Extraction failed')
+      }
+
+      // Response is NDJSON: a header line, then one line per word as it resolves
+      setVocabulary([])
+      setSelectedWords(new Set())
+      const reader = res.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      let count = 0
+      let isHeader = true
+
+      const handleLine = (line) => {
+        if (!line.trim()) return
+        const data = JSON.parse(line)
+        if (isHeader) {
+          isHeader = false
+          setStats(prev => ({ ...prev, known_words_count: data.known_words_count }))
+          return
+        }
+        const index = count++
+        setVocabulary(prev => [...prev, data])
+        setSelectedWords(prev => new Set(prev).add(index))
+        setStats(prev => ({ ...prev, new_words_count: count }))
+      }
+
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+        const lines = buffer.split('\n')
+        buffer = lines.pop()
+        lines.forEach(handleLine)
+      }
+      handleLine(buffer + decoder.decode())
+
+      showToast(`Found ${count} new words!`, 'success')
     } catch (error) {
       showToast('Failed to extract vocabulary', 'error')
     } finally {
@@ -3,16 +3,59 @@ Japanese Vocabulary Extractor
 Core logic for tokenizing Japanese text and fetching definitions from Jisho.org
 """
 
+import asyncio
+import httpx
+import orjson
+import os
+import re
 import requests
+import sqlite3
+import stat
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 from pathlib import Path
+from requests.adapters import HTTPAdapter
 from sudachipy import Dictionary, Tokenizer
 
-# Initialize SudachiPy tokenizer
-tokenizer = Dictionary().create()
+# Process umask, used for the mode of newly created known-words files
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# Initialize SudachiPy dictionary; tokenizers are created per thread
+_dictionary = Dictionary()
+_thread_local = threading.local()
+SPLIT_MODE = Tokenizer.SplitMode.C
+
+# Worker threads for tokenization, keeping it off the event loop
+_tokenize_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='tokenize')
+
+# Persistent cache of Jisho lookups, keyed by word
+CACHE_PATH = Path(__file__).parent / "jisho_cache.sqlite"
+_cache = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+_cache_lock = threading.Lock()
+# Single worker thread for cache reads and writes, keeping SQLite off the event loop
+_cache_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='jisho-cache')
+_cache.execute(
+    "CREATE TABLE IF NOT EXISTS defs(word TEXT PRIMARY KEY, reading TEXT, defs TEXT, ts INTEGER)"
+)
+_cache.commit()
+
+# Words Jisho has no entry for are cached too, but re-checked after a week
+NO_DEFINITION = 'No definition found'
+NO_DEFINITION_TTL = 7 * 24 * 60 * 60
+
+# Shared HTTP client for Jisho lookups (keep-alive, HTTP/2 multiplexing),
+# created on first use so it can be reopened after close_http_client()
+_client = None
+
+# Jisho lookups currently in flight, keyed by word
+_inflight = {}
 
 # Japanese particles to filter out
-PARTICLES = {
+PARTICLES = frozenset({
     'は', 'が', 'を', 'の', 'に', 'で', 'と', 'も', 'へ', 'から', 'まで',
     'より', 'か', 'や', 'など', 'て', 'た', 'だ', 'です', 'ます', 'ない',
     'ある', 'いる', 'する', 'なる', 'れる', 'られる', 'せる', 'させる',
@@ -23,10 +66,43 @@ PARTICLES = {
     # Punctuation and symbols
     '。', '、', '！', '？', '・', '「', '」', '『', '』', '（', '）',
     '…', '―', '〜', ' ', '　', '\n', '\r', '\t'
-}
+})
 
 # Part of speech tags to filter (particles, auxiliaries, punctuation)
-FILTER_POS = {'助詞', '助動詞', '記号', '補助記号', '空白'}
+FILTER_POS = frozenset({'助詞', '助動詞', '記号', '補助記号', '空白'})
+
+
+def _filter_pos_ids() -> frozenset:
+    """Collect the dictionary's numeric POS ids whose main category is in FILTER_POS."""
+    ids = set()
+    pos_id = 0
+    while (pos := _dictionary.pos_of(pos_id)) is not None:
+        if pos[0] in FILTER_POS:
+            ids.add(pos_id)
+        pos_id += 1
+    return frozenset(ids)
+
+
+# Lets the per-token POS check compare ints instead of fetching POS tuples
+FILTER_POS_IDS = _filter_pos_ids()
+
+# Matches any alphanumeric, kanji or kana character
+_VALID = re.compile(r'[^\W_]|[\u4e00-\u9fff\u3040-\u30ff]').search
+
+# Runs of characters that never form vocabulary (control characters, emoji,
+# pictographs, dingbats other than the circled digits, variation selectors)
+# are replaced before tokenizing. Everything else is left to SudachiPy, which
+# normalizes compatibility characters such as ㍻ or ㌔ into real words.
+_DISALLOWED = re.compile(
+    r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f\u2600-\u2775\u2794-\u27bf\u2b00-\u2bff'
+    r'\ufe00-\ufe0f\U0001f1e6-\U0001f1ff\U0001f300-\U0001faff]+'
+)
+
+# SudachiPy rejects inputs over ~48KB; 12000 chars stays under it even at 4 bytes/char
+MAX_CHUNK_CHARS = 12000
+
+# Characters to break chunks after, in order of preference
+SPLIT_BREAKS = ('\n', '。', '！？!?．', ' \t\u3000')
 
 
 def load_known_words(filepath: Path) -> set:
@@ -38,64 +114,239 @@ def load_known_words(filepath: Path) -> set:
 
 
 def save_known_words(words: set, filepath: Path):
-    """Save known words to file."""
-    with open(filepath, 'w', encoding='utf-8') as f:
-        for word in sorted(words):
-            f.write(f"{word}\n")
+    """
+    Save known words to file.
+    Writes to a temporary file and renames it over the target, so readers
+    never see a partially written list, and keeps the target's permissions.
+    """
+    content = ''.join(f"{word}\n" for word in sorted(words))
+    try:
+        mode = stat.S_IMODE(os.stat(filepath).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=filepath.parent,
+                                     suffix='.tmp', delete=False) as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        os.chmod(f.name, mode)
+        os.replace(f.name, filepath)
+    except OSError:
+        os.unlink(f.name)
+        raise
 
 
-def tokenize_text(text: str) -> list:
+def get_tokenizer():
+    """
+    Get the SudachiPy tokenizer for the current thread.
+    A tokenizer instance cannot be used from several threads at once.
+    """
+    tokenizer = getattr(_thread_local, 'tokenizer', None)
+    if tokenizer is None:
+        tokenizer = _thread_local.tokenizer = _dictionary.create()
+    return tokenizer
+
+
+def split_text(text: str, max_chars: int = MAX_CHUNK_CHARS) -> list:
+    """
+    Split text into chunks small enough for the tokenizer.
+    Prefers to break after a newline, then a full stop, then other sentence
+    punctuation, then whitespace; only cuts mid-run when none is found.
+    """
+    chunks = []
+    start = 0
+    while len(text) - start > max_chars:
+        end = start + max_chars
+        for breaks in SPLIT_BREAKS:
+            cut = max(text.rfind(c, start, end) for c in breaks)
+            if cut != -1:
+                end = cut + 1
+                break
+        chunks.append(text[start:end])
+        start = end
+    chunks.append(text[start:])
+    return chunks
+
+
+def append_known_words(words: set, filepath: Path):
     """
-    Tokenize Japanese text and return list of unique words.
+    Append newly known words to file.
+    Unlike save_known_words, existing entries are neither sorted nor rewritten.
+    """
+    if not words:
+        return
+    # A hand-edited file may lack a trailing newline; don't glue onto its last line
+    needs_newline = False
+    if filepath.exists() and filepath.stat().st_size > 0:
+        with open(filepath, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b'\n'
+    with open(filepath, 'a', encoding='utf-8') as f:
+        if needs_newline:
+            f.write('\n')
+        f.write(''.join(f"{word}\n" for word in words))
+
+
+def tokenize_text(text: str) -> dict:
+    """
+    Tokenize Japanese text and return unique words.
+    Returns a dict mapping word -> token info, in order of first appearance.
     Filters out particles and common function words.
     """
-    tokens = tokenizer.tokenize(text, Tokenizer.SplitMode.C)
-    words = []
-    seen = set()
+    # Bind globals to locals: the loop runs once per token
+    particles = PARTICLES
+    filter_pos_ids = FILTER_POS_IDS
+    is_valid = _VALID
+    words = {}
+    # Words rejected by the character checks; these depend only on the word
+    rejected = set()
+    rejected_add = rejected.add
+    
+    # Repeated lines can't add new words, and characters outside the
+    # whitelist can't form vocabulary: drop both before the expensive analysis
+    text = '\n'.join(dict.fromkeys(text.splitlines()))
+    text = _DISALLOWED.sub(' ', text)
+    tokenize = get_tokenizer().tokenize
+    tokens = chain.from_iterable(tokenize(chunk, SPLIT_MODE) for chunk in split_text(text))
     
     for token in tokens:
         # Get the dictionary form (lemma) of the word
         word = token.dictionary_form()
+        if word in words or word in rejected:
+            continue
         surface = token.surface()
-        reading = token.reading_form()
-        pos = token.part_of_speech()[0]  # Main POS category
         
-        # Skip if already seen, is a particle, or is in filter list
-        if word in seen or word in PARTICLES or surface in PARTICLES:
-            continue
-        if pos in FILTER_POS:
+        # Skip if it is a particle
+        if word in particles or surface in particles:
             continue
         # Skip single hiragana characters
-        if len(word) == 1 and '\u3040' <= word <= '\u309f':
+        if len(word) == 1 and 0x3040 <= ord(word) <= 0x309f:
+            rejected_add(word)
             continue
         # Skip if only contains punctuation or whitespace
-        if not any(c.isalnum() or '\u4e00' <= c <= '\u9fff' or '\u3040' <= c <= '\u30ff' for c in word):
+        if not is_valid(word):
+            rejected_add(word)
+            continue
+        # Skip filtered parts of speech
+        if token.part_of_speech_id() in filter_pos_ids:
             continue
             
-        seen.add(word)
-        words.append({
+        words[word] = {
             'word': word,
             'surface': surface,
-            'reading': reading,
-            'pos': pos
-        })
+            'reading': token.reading_form(),
+            'pos': token.part_of_speech()[0]  # Main POS category
+        }
     
     return words
 
 
-def fetch_definition(word: str, retries: int = 2) -> dict:
+async def tokenize_text_async(text: str) -> dict:
+    """Run tokenize_text in the tokenizer thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_tokenize_pool, tokenize_text, text)
+
+
+def get_cached_definitions(words: list) -> dict:
+    """
+    Look up cached definitions for multiple words in one query.
+    Returns a dict mapping word -> definition_data for cache hits only;
+    expired "no definition" entries count as misses.
     """
-    Fetch word definition from Jisho.org API.
+    results = {}
+    words = list(words)
+    min_ts = int(time.time()) - NO_DEFINITION_TTL
+    # Stay well under SQLite's bound-parameter limit
+    for i in range(0, len(words), 500):
+        chunk = words[i:i + 500]
+        placeholders = ','.join('?' * len(chunk))
+        with _cache_lock:
+            rows = _cache.execute(
+                f"SELECT word, reading, defs FROM defs WHERE word IN ({placeholders})"
+                " AND (defs != ? OR ts >= ?)",
+                (*chunk, NO_DEFINITION, min_ts)
+            ).fetchall()
+        for word, reading, definitions in rows:
+            results[word] = {'word': word, 'reading': reading, 'definitions': definitions}
+    return results
+
+
+def cache_definition(result: dict):
+    """Store a fetched definition (or a confirmed miss) in the cache."""
+    with _cache_lock:
+        _cache.execute(
+            "INSERT OR REPLACE INTO defs(word, reading, defs, ts) VALUES (?, ?, ?, ?)",
+            (result['word'], result['reading'], result['definitions'], int(time.time()))
+        )
+        _cache.commit()
+
+
+async def run_in_cache_thread(func, *args):
+    """Run a cache function in the cache worker thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_cache_pool, func, *args)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the shared Jisho HTTP client, creating it if it is missing or closed."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=16),
+            timeout=5.0
+        )
+    return _client
+
+
+async def close_http_client():
+    """Close the shared Jisho HTTP client; the next lookup opens a new one."""
+    if _client is not None:
+        await _client.aclose()
+
+
+async def fetch_definition(word: str, retries: int = 2) -> dict:
+    """
+    Fetch word definition, from the local cache if present, else from Jisho.org API.
+    Returns dict with reading and definitions.
+    """
+    cached = await run_in_cache_thread(get_cached_definitions, [word])
+    if word in cached:
+        return cached[word]
+    return await fetch_definition_from_jisho(word, retries)
+
+
+async def fetch_definition_from_jisho(word: str, retries: int = 2) -> dict:
+    """
+    Fetch word definition from Jisho.org API and cache the answer.
+    Concurrent callers asking for the same word share a single request.
     Returns dict with reading and definitions.
     """
-    url = f"https://jisho.org/api/v1/search/words?keyword={word}"
+    task = _inflight.get(word)
+    if task is None:
+        task = asyncio.ensure_future(_request_definition(word, retries))
+        _inflight[word] = task
+        task.add_done_callback(lambda _: _inflight.pop(word, None))
+    # Shield so one cancelled caller doesn't cancel the lookup for the others
+    return await asyncio.shield(task)
+
+
+async def _request_definition(word: str, retries: int) -> dict:
+    """Perform the Jisho.org lookup for a single word."""
+    url = "https://jisho.org/api/v1/search/words"
     
     for attempt in range(retries):
         try:
-            response = requests.get(url, timeout=5)
+            response = await get_http_client().get(url, params={'keyword': word})
             if response.status_code == 200:
-                data = response.json()
-                if data.get('data'):
+                data = orjson.loads(response.content)
+                if not data.get('data'):
+                    # Jisho answered but has no entry; retrying won't change that
+                    result = {'word': word, 'reading': '', 'definitions': NO_DEFINITION}
+                    await run_in_cache_thread(cache_definition, result)
+                    return result
+                else:
                     entry = data['data'][0]
                     
                     # Get reading
@@ -111,43 +362,66 @@ def fetch_definition(word: str, retries: int = 2) -> dict:
                             if sense.get('english_definitions'):
                                 definitions.append(', '.join(sense['english_definitions']))
                     
-                    return {
+                    result = {
                         'word': word,
                         'reading': reading,
-                        'definitions': '; '.join(definitions) if definitions else 'No definition found'
+                        'definitions': '; '.join(definitions) if definitions else NO_DEFINITION
                     }
+                    await run_in_cache_thread(cache_definition, result)
+                    return result
         except Exception as e:
             if attempt < retries - 1:
-                time.sleep(0.2)
+                await asyncio.sleep(0.2)
             continue
     
     return {'word': word, 'reading': '', 'definitions': 'Failed to fetch definition'}
 
 
-def fetch_definitions_batch(words: list, max_workers: int = 5) -> dict:
+async def iter_definitions(words: list, max_concurrency: int = 8):
     """
-    Fetch definitions for multiple words concurrently.
-    Returns a dict mapping word -> definition_data
+    Yield (word, definition_data) pairs as soon as each becomes available.
+    Cached words are yielded first; only cache misses hit the network.
     """
-    from concurrent.futures import ThreadPoolExecutor, as_completed
+    cached = await run_in_cache_thread(get_cached_definitions, words)
+    for word, def_data in cached.items():
+        yield word, def_data
     
-    results = {}
+    missing = [word for word in words if word not in cached]
+    if not missing:
+        return
     
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_word = {executor.submit(fetch_definition, word): word for word in words}
-        
-        for future in as_completed(future_to_word):
+    sem = asyncio.Semaphore(max_concurrency)
+    
+    async def fetch_limited(word: str) -> tuple:
+        async with sem:
             try:
-                result = future.result()
-                results[result['word']] = result
+                return word, await fetch_definition_from_jisho(word)
             except Exception:
-                word = future_to_word[future]
-                results[word] = {'word': word, 'reading': '', 'definitions': 'Error fetching'}
+                return word, {'word': word, 'reading': '', 'definitions': 'Error fetching'}
     
-    return results
+    for next_result in asyncio.as_completed([fetch_limited(word) for word in missing]):
+        yield await next_result
 
 
-def extract_vocabulary(text: str, known_words: set = None) -> list:
+async def fetch_definitions_batch(words: list, max_concurrency: int = 8) -> dict:
+    """
+    Fetch definitions for multiple words concurrently.
+    Returns a dict mapping word -> definition_data
+    """
+    return {word: def_data async for word, def_data in iter_definitions(words, max_concurrency)}
+
+
+def build_vocab_item(token: dict, def_data: dict) -> dict:
+    """Combine a token with its fetched definition into a vocabulary entry."""
+    return {
+        'word': token['word'],
+        'reading': def_data.get('reading') or token['reading'],
+        'definition': def_data.get('definitions', 'No definition'),
+        'pos': token['pos']
+    }
+
+
+async def extract_vocabulary(text: str, known_words: set = None) -> list:
     """
     Main function to extract vocabulary from Japanese text.
     Returns list of dicts with word, reading, and definition.
@@ -156,38 +430,39 @@ def extract_vocabulary(text: str, known_words: set = None) -> list:
     if known_words is None:
         known_words = set()
     
-    # Tokenize
-    tokens = tokenize_text(text)
+    # Tokenize (already unique per word)
+    tokens = await tokenize_text_async(text)
     
     # Filter out known words
-    unknown_tokens = [t for t in tokens if t['word'] not in known_words]
+    unknown_tokens = {w: t for w, t in tokens.items() if w not in known_words}
     
     if not unknown_tokens:
         return []
     
-    # Get unique words to fetch (avoid duplicate API calls)
-    unique_words = list(set(t['word'] for t in unknown_tokens))
-    
     # Fetch definitions concurrently
-    definitions_map = fetch_definitions_batch(unique_words)
+    definitions_map = await fetch_definitions_batch(list(unknown_tokens))
     
     # Build results
-    results = []
-    seen = set()
-    for token in unknown_tokens:
-        if token['word'] in seen:
-            continue
-        seen.add(token['word'])
-        
-        def_data = definitions_map.get(token['word'], {})
-        results.append({
-            'word': token['word'],
-            'reading': def_data.get('reading') or token['reading'],
-            'definition': def_data.get('definitions', 'No definition'),
-            'pos': token['pos']
-        })
+    return [
+        build_vocab_item(token, definitions_map.get(word, {}))
+        for word, token in unknown_tokens.items()
+    ]
+
+
+async def iter_vocabulary(text: str, known_words: set = None):
+    """
+    Streaming variant of extract_vocabulary.
+    Yields each vocabulary entry as soon as its definition is available,
+    so callers can emit results before the slowest lookup finishes.
+    """
+    if known_words is None:
+        known_words = set()
     
-    return results
+    tokens = await tokenize_text_async(text)
+    unknown_tokens = {w: t for w, t in tokens.items() if w not in known_words}
+    
+    async for word, def_data in iter_definitions(list(unknown_tokens)):
+        yield build_vocab_item(unknown_tokens[word], def_data)
 
 
 def export_to_csv(vocabulary: list, filepath: Path):
@@ -206,6 +481,10 @@ def export_to_csv(vocabulary: list, filepath: Path):
 
 ANKI_CONNECT_URL = "http://127.0.0.1:8765"
 
+# Shared session so AnkiConnect calls reuse pooled connections
+_session = requests.Session()
+_session.mount('http://', HTTPAdapter(pool_connections=10, pool_maxsize=16))
+
 
 def anki_request(action: str, params: dict = None) -> dict:
     """Make a request to AnkiConnect API."""
@@ -217,8 +496,13 @@ def anki_request(action: str, params: dict = None) -> dict:
         payload["params"] = params
     
     try:
-        response = requests.post(ANKI_CONNECT_URL, json=payload, timeout=5)
-        result = response.json()
+        response = _session.post(
+            ANKI_CONNECT_URL,
+            data=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"},
+            timeout=5
+        )
+        result = orjson.loads(response.content)
         if result.get("error"):
             return {"success": False, "error": result["error"]}
         return {"success": True, "result": result.get("result")}
@@ -270,9 +554,41 @@ def add_note_to_anki(word: str, reading: str, definition: str, deck_name: str =
     return anki_request("addNote", {"note": note})
 
 
+def escape_anki_search(text: str) -> str:
+    """Escape text for use inside a quoted Anki search term."""
+    return re.sub(r'([\\"*_])', r'\\\1', text)
+
+
+def find_existing_words(words: list, deck_name: str, chunk_size: int = 100) -> set:
+    """
+    Find which words already have a Basic note in the deck (not its subdecks).
+    Returns the set of matching Front values. If AnkiConnect fails the lookup
+    stops early; Anki's own duplicate check still applies when adding.
+    """
+    existing = set()
+    deck = escape_anki_search(deck_name)
+    for i in range(0, len(words), chunk_size):
+        fronts = ' OR '.join(f'"Front:{escape_anki_search(w)}"' for w in words[i:i + chunk_size])
+        query = f'"deck:{deck}" -"deck:{deck}::*" note:Basic ({fronts})'
+        found = anki_request("findNotes", {"query": query})
+        if not found["success"]:
+            break
+        if not found["result"]:
+            continue
+        info = anki_request("notesInfo", {"notes": found["result"]})
+        if not info["success"]:
+            break
+        for note in info["result"]:
+            front = note.get("fields", {}).get("Front")
+            if front:
+                existing.add(front["value"])
+    return existing
+
+
 def add_notes_to_anki(vocabulary: list, deck_name: str = "Japanese Vocabulary", tags: list = None) -> dict:
     """
     Add multiple notes to Anki at once.
+    Words already in the deck are skipped before sending.
     Returns dict with success count, fail count, and details.
     """
     if tags is None:
@@ -283,8 +599,12 @@ def add_notes_to_anki(vocabulary: list, deck_name: str = "Japanese Vocabulary",
     if not create_result["success"]:
         return create_result
     
+    existing = find_existing_words([item["word"] for item in vocabulary], deck_name)
+    
     notes = []
     for item in vocabulary:
+        if item["word"] in existing:
+            continue
         notes.append({
             "deckName": deck_name,
             "modelName": "Basic",
@@ -304,15 +624,17 @@ def add_notes_to_anki(vocabulary: list, deck_name: str = "Japanese Vocabulary",
             }
         })
     
-    result = anki_request("addNotes", {"notes": notes})
-    
-    if not result["success"]:
-        return result
+    note_ids = []
+    if notes:
+        result = anki_request("addNotes", {"notes": notes})
+        
+        if not result["success"]:
+            return result
+        note_ids = result["result"]
     
-    # Count successes and failures
-    note_ids = result["result"]
+    # Count successes and failures (pre-filtered words count as duplicates)
     success_count = sum(1 for nid in note_ids if nid is not None)
-    fail_count = len(note_ids) - success_count
+    fail_count = len(vocabulary) - success_count
     
     return {
         "success": True,